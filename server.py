@@ -1,23 +1,86 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
 import os
+import time
+
+def process_age():
+    """Seconds since this process started (Linux /proc), None where that's unknown"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 is the start time in clock ticks after boot; skip the
+            # command name in parentheses, it may contain spaces
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+# Startup is timed from process start, so the interpreter's own startup counts
+# too - or from here if the platform can't tell
+_process_age = process_age()
+STARTUP_T0 = time.perf_counter() - (_process_age or 0.0)
+STARTUP_ORIGIN = 'process start' if _process_age is not None else 'module load'
+
+from flask import Flask, Response, request, jsonify, send_from_directory
+from flask_cors import CORS
+import sys
 import json
+import re
 import subprocess
 import uuid
-from datetime import datetime
+import hashlib
+import tempfile
+import threading
+import tarfile
+import http.client
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
 from werkzeug.security import safe_join
+from werkzeug.serving import make_server
 
 app = Flask(__name__)
 CORS(app)
 
+# --- STARTUP TIMING ---
+
+# Time-to-ready goal (seconds) the startup report is checked against
+STARTUP_TARGET = float(os.environ.get('JUKEBOX_STARTUP_TARGET', 1.0))
+startup_timings = []
+
+def mark_startup(phase):
+    """Record how long after STARTUP_ORIGIN a startup phase finished"""
+    startup_timings.append((phase, time.perf_counter() - STARTUP_T0))
+
+def print_startup_report(warm_up_time=None, songs=None):
+    """Print the startup phases and compare time-to-ready (and warm-up) with the target"""
+    print(f"⏱️  Startup (since {STARTUP_ORIGIN}):")
+    previous = 0.0
+    for phase, elapsed in startup_timings:
+        print(f"   {phase:<12} {elapsed * 1000:8.1f} ms  (+{(elapsed - previous) * 1000:.1f} ms)")
+        previous = elapsed
+    ready = dict(startup_timings).get('ready')
+    if ready is not None:
+        status = "✅" if ready <= STARTUP_TARGET else "⚠️"
+        print(f"   {status} ready in {ready:.3f} s (target {STARTUP_TARGET:.3f} s)")
+    if warm_up_time is not None:
+        status = "✅" if warm_up_time <= STARTUP_TARGET else "⚠️"
+        print(f"   {status} warm-up in {warm_up_time:.3f} s with {songs} songs (target {STARTUP_TARGET:.3f} s)")
+
+mark_startup('imports')
+
 # Configuration - Data folder OUTSIDE of git repository
 # Use absolute path to avoid path resolution issues
+# JUKEBOX_DATA_FOLDER / JUKEBOX_PORT allow several instances on one machine
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FOLDER = os.path.abspath(os.path.join(SCRIPT_DIR, '..', 'jukebox_data'))
+DATA_FOLDER = os.path.abspath(os.environ.get('JUKEBOX_DATA_FOLDER') or
+                              os.path.join(SCRIPT_DIR, '..', 'jukebox_data'))
 UPLOAD_FOLDER = os.path.join(DATA_FOLDER, 'music')
 COVERS_FOLDER = os.path.join(DATA_FOLDER, 'covers')
 METADATA_FILE = os.path.join(DATA_FOLDER, 'songs_metadata.json')
+SYNC_STATE_FILE = os.path.join(DATA_FOLDER, 'sync_state.json')
+PLAY_COUNTS_FILE = os.path.join(DATA_FOLDER, 'play_counts.json')
+PORT = int(os.environ.get('JUKEBOX_PORT', 5001))
 
 UNITY_FOLDER = 'webgl_build'
 
@@ -30,8 +93,25 @@ for folder in [DATA_FOLDER, UPLOAD_FOLDER, COVERS_FOLDER]:
         os.makedirs(folder)
         print(f"Created folder: {folder}")
 
+mark_startup('folders')
+
 # --- METADATA FUNCTIONS ---
 
+# Held around every load -> modify -> save of the metadata, so concurrent
+# requests don't overwrite each other's changes
+metadata_lock = threading.RLock()
+
+def write_json_atomic(path, data, **dump_args):
+    """Write JSON via a unique temp file + rename, so readers never see a half-written file"""
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_args)
+        os.replace(tmp_file, path)
+    except:
+        os.remove(tmp_file)
+        raise
+
 def load_metadata():
     """Load metadata from JSON file"""
     if os.path.exists(METADATA_FILE):
@@ -43,9 +123,37 @@ def load_metadata():
     return {}
 
 def save_metadata(metadata):
-    """Save metadata to JSON file"""
-    with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    """Save metadata to JSON file (atomically - call with metadata_lock held)"""
+    global _catalog_cache
+    write_json_atomic(METADATA_FILE, metadata, ensure_ascii=False, indent=2)
+    _catalog_cache = None
+
+# Parsed catalog for read-only use, keyed by the file's (mtime, size) so
+# edits from outside the server are picked up too
+_catalog_cache = None
+
+def get_catalog():
+    """Cached (metadata, songs list) - never modify these, use load_metadata() to edit"""
+    global _catalog_cache
+    try:
+        st = os.stat(METADATA_FILE)
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    cache = _catalog_cache
+    if cache is None or cache[0] != key:
+        metadata = load_metadata()
+        songs = [{
+            'id': song_id,
+            'filename': data.get('filename', ''),
+            'title': data.get('title', ''),
+            'description': data.get('description', ''),
+            'cover': data.get('cover', None),
+            'uploaded_at': data.get('uploaded_at', '')
+        } for song_id, data in metadata.items()]
+        cache = (key, metadata, songs)
+        _catalog_cache = cache
+    return cache[1], cache[2]
 
 def generate_song_id():
     """Generate a unique song ID"""
@@ -53,31 +161,296 @@ def generate_song_id():
 
 def get_song_by_id(song_id):
     """Get song data by ID"""
-    metadata = load_metadata()
-    for sid, data in metadata.items():
-        if sid == song_id:
-            return data
-    return None
+    metadata, _ = get_catalog()
+    return metadata.get(song_id)
 
 def get_all_songs():
     """Get all songs with their IDs"""
-    metadata = load_metadata()
-    songs = []
-    for song_id, data in metadata.items():
-        songs.append({
-            'id': song_id,
-            'filename': data.get('filename', ''),
-            'title': data.get('title', ''),
-            'description': data.get('description', ''),
-            'cover': data.get('cover', None),
-            'uploaded_at': data.get('uploaded_at', '')
-        })
+    _, songs = get_catalog()
     return songs
 
+# --- CATALOG VERSION & CONTENT HASH FUNCTIONS ---
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def get_catalog_version(metadata=None, tombstones=None):
+    """Current catalog version (highest song or deletion version, 0 for an empty catalog)"""
+    if metadata is None:
+        metadata = load_metadata()
+    if tombstones is None:
+        tombstones = load_sync_state()['tombstones']
+    return max((data.get('version', 0) for data in list(metadata.values()) + list(tombstones.values())),
+               default=0)
+
+def touch_song(metadata, song_id):
+    """Mark a song as changed locally: next catalog version + version vector bump"""
+    song = metadata[song_id]
+    song['version'] = get_catalog_version(metadata) + 1
+    song['updated_at'] = datetime.now(timezone.utc).isoformat()
+    song['updated_by'] = get_instance_id()
+    song['vv'] = vv_increment(song.get('vv', {}))
+
+def file_sha256(path):
+    """SHA-256 of a file, read in fixed-size chunks"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def set_file_info(data, prefix, path):
+    """Store size and hash of a song's audio/cover file in its metadata"""
+    data[f'{prefix}_size'] = os.path.getsize(path)
+    data[f'{prefix}_sha256'] = file_sha256(path)
+
+HASH_SAVE_EVERY = 50
+
+def find_unhashed_files(metadata):
+    """(song_id, prefix, name_key, name) of every audio/cover file without a hash yet"""
+    unhashed = []
+    for song_id, data in metadata.items():
+        for name_key, prefix in [('filename', 'audio'), ('cover', 'cover')]:
+            name = data.get(name_key)
+            if name and not (data.get(f'{prefix}_sha256') and f'{prefix}_size' in data):
+                unhashed.append((song_id, prefix, name_key, name))
+    return unhashed
+
+def get_pending_songs(metadata):
+    """IDs of songs whose files are not hashed yet (manifests leave them out for now)"""
+    return sorted({song_id for song_id, _, _, _ in find_unhashed_files(metadata)})
+
+_hash_event = threading.Event()
+_hash_thread = None
+
+def request_hashing():
+    """Wake the background hash worker, starting it on first use"""
+    global _hash_thread
+    with metadata_lock:
+        if _hash_thread is None:
+            _hash_thread = threading.Thread(target=hash_worker, daemon=True)
+            _hash_thread.start()
+    _hash_event.set()
+
+def hash_worker():
+    """Hash files that have no hash yet (e.g. copied in via USB or from before hashes existed).
+
+    Hashing a big library takes minutes, so it runs here instead of in a
+    request, without holding the metadata lock.
+    """
+    while True:
+        _hash_event.wait()
+        _hash_event.clear()
+        results = []
+        for song_id, prefix, name_key, name in find_unhashed_files(load_metadata()):
+            path = os.path.join(UPLOAD_FOLDER if prefix == 'audio' else COVERS_FOLDER, name)
+            try:
+                results.append((song_id, prefix, name_key, name, os.path.getsize(path), file_sha256(path)))
+            except OSError:
+                continue
+            if len(results) >= HASH_SAVE_EVERY:
+                _apply_hashes(results)
+                results = []
+        _apply_hashes(results)
+
+def _apply_hashes(results):
+    """Store computed hashes in the current metadata"""
+    if not results:
+        return
+    with metadata_lock:
+        metadata = load_metadata()
+        # New catalog version, so incremental manifests pick the songs up now
+        version = get_catalog_version(metadata) + 1
+        for song_id, prefix, name_key, name, size, sha256 in results:
+            data = metadata.get(song_id)
+            # Skip songs that were deleted or got a new file in the meantime
+            if data and data.get(name_key) == name and not data.get(f'{prefix}_sha256'):
+                data[f'{prefix}_size'] = size
+                data[f'{prefix}_sha256'] = sha256
+                data['version'] = version
+        save_metadata(metadata)
+
+# --- SYNC STATE & VERSION VECTOR FUNCTIONS ---
+
+_instance_id = None
+
+def load_sync_state():
+    """Load instance ID, deletion tombstones and replaced cover names"""
+    if os.path.exists(SYNC_STATE_FILE):
+        try:
+            with open(SYNC_STATE_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except:
+            state = {}
+    else:
+        state = {}
+    state.setdefault('tombstones', {})
+    # Old cover name -> catalog version it was replaced in (for prefetch 'removed')
+    state.setdefault('replaced_covers', {})
+    return state
+
+def save_sync_state(state):
+    """Save sync state (atomically, like the metadata - call with metadata_lock held)"""
+    write_json_atomic(SYNC_STATE_FILE, state, ensure_ascii=False, indent=2)
+
+def get_instance_id():
+    """Stable ID of this jukebox, created on first use"""
+    global _instance_id
+    if _instance_id is None:
+        with metadata_lock:
+            state = load_sync_state()
+            if not state.get('instance_id'):
+                state['instance_id'] = str(uuid.uuid4())
+                save_sync_state(state)
+            _instance_id = state['instance_id']
+    return _instance_id
+
+def vv_increment(vv):
+    """Version vector with this instance's counter bumped"""
+    vv = dict(vv)
+    vv[get_instance_id()] = vv.get(get_instance_id(), 0) + 1
+    return vv
+
+def vv_merge(a, b):
+    """Element-wise maximum of two version vectors"""
+    return {k: max(a.get(k, 0), b.get(k, 0)) for k in set(a) | set(b)}
+
+def vv_compare(a, b):
+    """Compare version vectors: 'equal', 'newer' (a dominates), 'older' or 'concurrent'"""
+    keys = set(a) | set(b)
+    a_ge = all(a.get(k, 0) >= b.get(k, 0) for k in keys)
+    b_ge = all(b.get(k, 0) >= a.get(k, 0) for k in keys)
+    if a_ge and b_ge:
+        return 'equal'
+    if a_ge:
+        return 'newer'
+    if b_ge:
+        return 'older'
+    return 'concurrent'
+
+def remote_wins(local, remote):
+    """Conflict resolution: version vectors first, last writer wins if concurrent"""
+    order = vv_compare(local.get('vv', {}), remote.get('vv', {}))
+    if order == 'older':
+        return True
+    if order == 'newer':
+        return False
+    # Concurrent edits (or legacy entries without a vector): last writer wins
+    return ((remote.get('updated_at', ''), remote.get('updated_by', '')) >
+            (local.get('updated_at', ''), local.get('updated_by', '')))
+
+def make_tombstone(song, version):
+    """Deletion marker, so peers (and prefetch clients) learn about the deletion"""
+    return {
+        'version': version,
+        'cover': song.get('cover'),
+        'vv': vv_increment(song.get('vv', {})),
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+        'updated_by': get_instance_id(),
+        'deleted': True
+    }
+
+def delete_unused_file(metadata, name_key, name):
+    """Delete an audio ('filename') or cover file unless a song in `metadata` still uses it"""
+    if not name or any(d.get(name_key) == name for d in metadata.values()):
+        return
+    path = os.path.join(UPLOAD_FOLDER if name_key == 'filename' else COVERS_FOLDER, name)
+    if os.path.exists(path):
+        os.remove(path)
+
+def delete_song_files(metadata, song_id):
+    """Delete a song's audio and cover unless another song still uses them"""
+    others = {sid: d for sid, d in metadata.items() if sid != song_id}
+    for name_key in ['filename', 'cover']:
+        delete_unused_file(others, name_key, metadata[song_id].get(name_key))
+
+def merge_remote_songs(metadata, tombstones, remote_songs, remote_tombstones=None,
+                       renamed=None, restore=False, replaced_covers=None):
+    """Merge songs (and deletions) from a peer or archive into local metadata.
+
+    `renamed` maps remote audio/cover filenames to local ones. With
+    `restore=True` (archive import) local tombstones are ignored, so a
+    backup brings deleted songs back. Cover names that a song no longer
+    uses are recorded in `replaced_covers`.
+    """
+    renamed = renamed or {'music': {}, 'covers': {}}
+    next_version = get_catalog_version(metadata, tombstones) + 1
+    stats = {'songs_added': 0, 'songs_updated': 0, 'songs_deleted': 0}
+    # (name_key, name) of files that may be unused now - only deleted once the whole
+    # batch is merged, since a later song may take over the file (A -> Y, B -> X)
+    replaced_files = []
+
+    for song_id, remote in remote_songs.items():
+        local = metadata.get(song_id) or (None if restore else tombstones.get(song_id))
+        if local and not remote_wins(local, remote):
+            # Keep ours, but remember what the peer has seen
+            merged_vv = vv_merge(local.get('vv', {}), remote.get('vv', {}))
+            if merged_vv != local.get('vv', {}):
+                local['vv'] = merged_vv
+                if song_id in metadata:
+                    local['version'] = next_version
+            continue
+
+        song = dict(remote)
+        if song.get('filename'):
+            song['filename'] = renamed['music'].get(song['filename'], song['filename'])
+        if song.get('cover'):
+            song['cover'] = renamed['covers'].get(song['cover'], song['cover'])
+        song['vv'] = vv_merge(local.get('vv', {}) if local else {}, remote.get('vv', {}))
+        if restore and song_id in tombstones:
+            # Restoring a deleted song is a new local write that beats the deletion
+            song['vv'] = vv_increment(vv_merge(song['vv'], tombstones[song_id]['vv']))
+            song['updated_at'] = datetime.now(timezone.utc).isoformat()
+            song['updated_by'] = get_instance_id()
+        song['version'] = next_version
+        tombstones.pop(song_id, None)
+        stats['songs_updated' if song_id in metadata else 'songs_added'] += 1
+        replaced = metadata.get(song_id, {})
+        metadata[song_id] = song
+        # A new audio/cover name (e.g. cover re-uploaded on the peer) may orphan the old file
+        for name_key in ['filename', 'cover']:
+            if replaced.get(name_key) != song.get(name_key):
+                replaced_files.append((name_key, replaced.get(name_key)))
+        if replaced.get('cover') and replaced['cover'] != song.get('cover') and replaced_covers is not None:
+            replaced_covers[replaced['cover']] = next_version
+
+    for song_id, remote in (remote_tombstones or {}).items():
+        local = metadata.get(song_id) or tombstones.get(song_id)
+        if local and not remote_wins(local, remote):
+            merged_vv = vv_merge(local.get('vv', {}), remote.get('vv', {}))
+            if merged_vv != local.get('vv', {}):
+                local['vv'] = merged_vv
+                if song_id in metadata:
+                    local['version'] = next_version
+            continue
+        # Our own cover name, so prefetch clients get the right 'removed' entry
+        cover = None
+        if song_id in metadata:
+            deleted = metadata.pop(song_id)
+            cover = deleted.get('cover')
+            replaced_files.extend([('filename', deleted.get('filename')), ('cover', cover)])
+            stats['songs_deleted'] += 1
+        elif song_id in tombstones:
+            cover = tombstones[song_id].get('cover')
+        tombstones[song_id] = dict(remote, version=next_version, cover=cover,
+                                   vv=vv_merge(local.get('vv', {}) if local else {}, remote.get('vv', {})))
+
+    for name_key, name in replaced_files:
+        delete_unused_file(metadata, name_key, name)
+    return stats
+
 # --- GIT FUNCTIONS ---
 
-def get_git_info():
-    """Get current git branch and last commit info"""
+_git_info = None
+
+def get_git_info(refresh=False):
+    """Get current git branch and last commit info (cached - it only changes on git pull)"""
+    global _git_info
+    if _git_info is None or refresh:
+        _git_info = read_git_info()
+    return _git_info
+
+def read_git_info():
+    """Run git to read branch and last commit"""
     try:
         branch = subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD'], 
                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
@@ -93,135 +466,583 @@ def git_pull():
         result = subprocess.check_output(['git', 'pull'], 
                                         cwd=os.path.dirname(os.path.abspath(__file__)),
                                         stderr=subprocess.STDOUT).decode()
+        get_git_info(refresh=True)
         return {'success': True, 'output': result}
     except subprocess.CalledProcessError as e:
         return {'success': False, 'output': e.output.decode()}
 
-# --- ROUTES ---
+# --- ARCHIVE FUNCTIONS (EXPORT / IMPORT) ---
 
-# 1. Serve the Unity Game (Homepage)
-@app.route('/')
-def index():
-    if not os.path.exists(os.path.join(UNITY_FOLDER, 'index.html')):
-        return "<h1>Unity Build Not Found</h1><p>Ensure your WebGL files are in the 'webgl_build' folder.</p>"
-    return send_from_directory(UNITY_FOLDER, 'index.html')
+ARCHIVE_CATALOG_NAME = 'catalog.json'
+ARCHIVE_FOLDERS = {'music': UPLOAD_FOLDER, 'covers': COVERS_FOLDER}
 
-# 2. Support Unity static files (.js, .wasm, .data)
-@app.route('/<path:path>')
-def serve_static(path):
-    # Don't serve our management routes as static files
-    if path.startswith('api/') or path in ['upload', 'manage', 'settings']:
-        return "Not found", 404
-    return send_from_directory(UNITY_FOLDER, path)
+ARCHIVE_NAME_KEYS = {'music': ('filename', 'audio'), 'covers': ('cover', 'cover')}
 
-# 3. API: List all songs with metadata for Unity
-@app.route('/api/songs')
-def list_songs():
-    songs = get_all_songs()
-    return jsonify(songs)
+def _tar_header(arcname, size, mtime):
+    """PAX tar header for one file, so files > 8 GB are fine"""
+    info = tarfile.TarInfo(arcname)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
 
-# 4. Stream Audio File by ID
-@app.route('/api/stream/<song_id>')
-def stream_song(song_id):
-    print(f"\n{'='*60}")
-    print(f"🎵 Stream request for ID: {song_id}")
-    print(f"{'='*60}")
-    
-    # Load metadata
+def _tar_padding(size):
+    """NUL bytes filling a member up to the next tar block"""
+    return tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+def _tar_file_chunks(arcname, path):
+    """Header, content and padding of one file - never more than one chunk in memory"""
+    size = os.path.getsize(path)
+    yield _tar_header(arcname, size, os.path.getmtime(path))
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                # File shrank while exporting - keep the archive consistent
+                yield tarfile.NUL * remaining
+                break
+            remaining -= len(chunk)
+            yield chunk
+    yield _tar_padding(size)
+
+def generate_export_archive(metadata, tombstones, since=0):
+    """Generator yielding a tar archive of catalog, audio and covers.
+
+    `since=0` is a full backup (including songs from before catalog
+    versions existed); otherwise only songs with a higher version are
+    included. Deletions newer than `since` go into the catalog as
+    tombstones, so an incremental import removes them as well.
+    Tar headers are written by hand so each file is streamed chunk by
+    chunk instead of going through tarfile's buffering.
+    """
+    songs = {sid: data for sid, data in metadata.items() if not since or data.get('version', 0) > since}
+    catalog = json.dumps({
+        'catalog_version': get_catalog_version(metadata, tombstones),
+        'since': since,
+        'songs': songs,
+        'tombstones': {sid: t for sid, t in tombstones.items() if t.get('version', 0) > since}
+    }, ensure_ascii=False, indent=2).encode('utf-8')
+
+    written = 0
+    for chunk in [_tar_header(ARCHIVE_CATALOG_NAME, len(catalog), datetime.now().timestamp()),
+                  catalog, _tar_padding(len(catalog))]:
+        written += len(chunk)
+        yield chunk
+
+    for data in songs.values():
+        for folder_name, name in [('music', data.get('filename')), ('covers', data.get('cover'))]:
+            if not name:
+                continue
+            path = os.path.join(ARCHIVE_FOLDERS[folder_name], name)
+            if not os.path.exists(path):
+                print(f"⚠️ Export: missing file {path}")
+                continue
+            for chunk in _tar_file_chunks(f"{folder_name}/{name}", path):
+                written += len(chunk)
+                yield chunk
+
+    # End-of-archive marker, padded to a full tar record
+    end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    written += len(end)
+    yield end + tarfile.NUL * (-written % tarfile.RECORDSIZE)
+
+def _place_file(part_path, folder, filename, sha256):
+    """Move a verified .part file into `folder` without clobbering a different file.
+
+    If `filename` (or its hash-suffixed variant) already holds the same
+    content, that file is reused. Returns (local filename, written).
+    """
+    stem, ext = os.path.splitext(filename)
+    candidates = [filename, f"{stem}_{sha256[:8]}{ext}", f"{stem}_{sha256}{ext}"]
+    for candidate in candidates:
+        path = os.path.join(folder, candidate)
+        if os.path.exists(path) and file_sha256(path) == sha256:
+            os.remove(part_path)
+            return candidate, False
+        if not os.path.exists(path) or candidate == candidates[-1]:
+            os.replace(part_path, path)
+            return candidate, True
+
+def _import_file(fileobj, folder, filename, known_hashes):
+    """Stream one archive member to disk, hashing on the way.
+
+    Returns (local filename, sha256, written) - written is False if a
+    file with the same content already existed.
+    """
+    part_path = os.path.join(folder, f".{filename}.part")
+    h = hashlib.sha256()
+    try:
+        with open(part_path, 'wb') as out:
+            for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b''):
+                h.update(chunk)
+                out.write(chunk)
+    except:
+        os.remove(part_path)
+        raise
+    sha256 = h.hexdigest()
+
+    if sha256 in known_hashes:
+        os.remove(part_path)
+        return known_hashes[sha256], sha256, False
+
+    local_name, written = _place_file(part_path, folder, filename, sha256)
+    known_hashes[sha256] = local_name
+    return local_name, sha256, written
+
+def import_archive(stream):
+    """Stream-unpack an export archive and merge it into the local catalog.
+
+    Files whose content hash already exists locally are skipped. Songs
+    whose files are missing from the archive (or have unsafe names) are
+    dropped, and hashes/sizes come from the unpacked files, not from the
+    archive's catalog. All metadata changes are written with a single
+    save_metadata() call.
+    """
     metadata = load_metadata()
-    print(f"📋 Available song IDs: {list(metadata.keys())}")
-    
-    # Get song data
-    song = get_song_by_id(song_id)
-    if not song:
-        print(f"❌ Song not found for ID: {song_id}")
-        return jsonify({"error": "Song not found"}), 404
-    
-    filename = song.get('filename')
-    if not filename:
-        print(f"❌ No filename in song data for ID: {song_id}")
-        return jsonify({"error": "Invalid song data"}), 404
-    
-    print(f"📂 Filename from metadata: {filename}")
-    print(f"📂 Upload folder: {app.config['UPLOAD_FOLDER']}")
-    
-    # Build absolute path
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    abs_file_path = os.path.abspath(file_path)
-    
-    print(f"📂 Relative path: {file_path}")
-    print(f"📂 Absolute path: {abs_file_path}")
-    print(f"📂 File exists: {os.path.exists(abs_file_path)}")
-    
-    # List all files in directory for debugging
-    if os.path.exists(app.config['UPLOAD_FOLDER']):
-        all_files = os.listdir(app.config['UPLOAD_FOLDER'])
-        print(f"📂 All files in upload folder: {all_files}")
-    else:
-        print(f"❌ Upload folder does not exist: {app.config['UPLOAD_FOLDER']}")
-    
-    if not os.path.exists(abs_file_path):
-        print(f"❌ File not found: {abs_file_path}")
-        return jsonify({"error": "Audio file not found on disk"}), 404
-    
-    print(f"✅ Streaming: {filename}")
-    print(f"{'='*60}\n")
-    
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    known_hashes = {
+        'music': {d['audio_sha256']: d['filename'] for d in metadata.values() if d.get('audio_sha256')},
+        'covers': {d['cover_sha256']: d['cover'] for d in metadata.values() if d.get('cover_sha256')}
+    }
 
-# 5. Serve Cover Images
-@app.route('/covers/<path:filename>')
-def get_cover(filename):
-    return send_from_directory(app.config['COVERS_FOLDER'], filename)
+    incoming = {}
+    incoming_tombstones = {}
+    expected_hashes = {'music': {}, 'covers': {}}
+    renamed = {'music': {}, 'covers': {}}
+    file_hashes = {'music': {}, 'covers': {}}
+    written_files = []
+    stats = {'files_written': 0, 'files_skipped': 0, 'songs_rejected': 0}
 
-# 6. Drag & Drop Upload Page
-@app.route('/upload', methods=['GET', 'POST'])
-def upload_file():
-    if request.method == 'POST':
-        if 'file' not in request.files:
-            return jsonify({"error": "Keine Datei gefunden"}), 400
-        file = request.files['file']
-        if file and file.filename.endswith('.mp3'):
-            filename = secure_filename(file.filename)
-            
-            # Generate unique ID for this song
-            song_id = generate_song_id()
-            
-            # Build absolute path
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            abs_file_path = os.path.abspath(file_path)
-            
-            print(f"\n{'='*60}")
-            print(f"📤 Upload Request")
-            print(f"{'='*60}")
-            print(f"Original filename: {file.filename}")
-            print(f"Secure filename: {filename}")
-            print(f"Song ID: {song_id}")
-            print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
-            print(f"File path: {abs_file_path}")
-            
-            # Save file
-            file.save(abs_file_path)
-            print(f"✅ File saved successfully")
-            print(f"File exists after save: {os.path.exists(abs_file_path)}")
-            
-            # Initialize metadata with ID
+    with tarfile.open(fileobj=stream, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+
+            if member.name == ARCHIVE_CATALOG_NAME:
+                catalog = json.load(tar.extractfile(member))
+                incoming = catalog.get('songs', {})
+                incoming_tombstones = {sid: t for sid, t in catalog.get('tombstones', {}).items()
+                                       if isinstance(t, dict)}
+                for data in incoming.values():
+                    if data.get('filename') and data.get('audio_sha256'):
+                        expected_hashes['music'][data['filename']] = data['audio_sha256']
+                    if data.get('cover') and data.get('cover_sha256'):
+                        expected_hashes['covers'][data['cover']] = data['cover_sha256']
+                continue
+
+            folder_name, _, name = member.name.partition('/')
+            if folder_name not in ARCHIVE_FOLDERS or secure_filename(name) != name or not name:
+                print(f"⚠️ Import: ignoring {member.name}")
+                continue
+
+            # Known content: skip without touching the disk
+            expected = expected_hashes[folder_name].get(name)
+            if expected and expected in known_hashes[folder_name]:
+                renamed[folder_name][name] = known_hashes[folder_name][expected]
+                file_hashes[folder_name][name] = expected
+                stats['files_skipped'] += 1
+                continue
+
+            local_name, sha256, written = _import_file(tar.extractfile(member), ARCHIVE_FOLDERS[folder_name],
+                                                       name, known_hashes[folder_name])
+            renamed[folder_name][name] = local_name
+            file_hashes[folder_name][name] = sha256
+            if written:
+                written_files.append((ARCHIVE_NAME_KEYS[folder_name][0], local_name))
+            stats['files_written' if written else 'files_skipped'] += 1
+
+    # Only songs whose audio (and cover, if any) arrived in this archive - `renamed`
+    # only holds safe names, so this also rejects names like '../x' or '/tmp/x'
+    songs = {}
+    for song_id, data in incoming.items():
+        song = dict(data)
+        for folder_name, (name_key, prefix) in ARCHIVE_NAME_KEYS.items():
+            name = data.get(name_key)
+            if not name and name_key == 'cover':
+                song.pop('cover_sha256', None)
+                song.pop('cover_size', None)
+                continue
+            if not isinstance(name, str) or name not in renamed[folder_name]:
+                song = None
+                break
+            song[f'{prefix}_sha256'] = file_hashes[folder_name][name]
+            song[f'{prefix}_size'] = os.path.getsize(
+                os.path.join(ARCHIVE_FOLDERS[folder_name], renamed[folder_name][name]))
+        if song is None:
+            print(f"⚠️ Import: skipping song {song_id} - file missing from archive or unsafe name")
+            stats['songs_rejected'] += 1
+            continue
+        songs[song_id] = song
+
+    # Merge metadata: new songs are added, existing ones updated if the archive is newer.
+    # Re-read under the lock - uploads and edits may have happened while streaming.
+    with metadata_lock:
+        metadata = load_metadata()
+        state = load_sync_state()
+        stats.update(merge_remote_songs(metadata, state['tombstones'], songs,
+                                        remote_tombstones=incoming_tombstones, renamed=renamed,
+                                        restore=True, replaced_covers=state['replaced_covers']))
+        save_metadata(metadata)
+        save_sync_state(state)
+        # Files written for songs that lost the merge (or that no song references)
+        for name_key, local_name in written_files:
+            delete_unused_file(metadata, name_key, local_name)
+        stats['catalog_version'] = get_catalog_version(metadata, state['tombstones'])
+    return stats
+
+# --- SYNC FUNCTIONS (PEER-TO-PEER) ---
+
+SYNC_WORKERS = 4
+SYNC_RETRIES = 3
+SYNC_TIMEOUT = 30
+SYNC_PEERS = [p.rstrip('/') for p in os.environ.get('JUKEBOX_SYNC_PEERS', '').split(',') if p.strip()]
+SYNC_INTERVAL = int(os.environ.get('JUKEBOX_SYNC_INTERVAL', 300))
+
+_sync_lock = threading.Lock()
+
+def build_sync_manifest():
+    """Everything a peer needs to compute a diff: songs with hashes and versions, plus deletions"""
+    metadata, _ = get_catalog()
+    pending = get_pending_songs(metadata)
+    if pending:
+        request_hashing()
+    return {
+        'instance_id': get_instance_id(),
+        'catalog_version': get_catalog_version(metadata),
+        'songs': metadata,
+        'pending': pending,
+        'tombstones': load_sync_state()['tombstones']
+    }
+
+def _fetch_json(url):
+    with urllib.request.urlopen(url, timeout=SYNC_TIMEOUT) as resp:
+        return json.load(resp)
+
+def _download_file(url, folder, filename, expected_sha256, expected_size):
+    """Download into a .part file, resuming with a Range request after failures.
+
+    Returns the local filename of the verified file.
+    """
+    part_path = os.path.join(folder, f".{filename}.part")
+    for attempt in range(1, SYNC_RETRIES + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        try:
+            if expected_size is None or offset < expected_size:
+                headers = {'X-Jukebox-Sync': '1'}
+                if offset:
+                    headers['Range'] = f'bytes={offset}-'
+                req = urllib.request.Request(url, headers=headers)
+                with urllib.request.urlopen(req, timeout=SYNC_TIMEOUT) as resp:
+                    # Server ignored the Range header: start over
+                    mode = 'ab' if offset and resp.status == 206 else 'wb'
+                    with open(part_path, mode) as out:
+                        for chunk in iter(lambda: resp.read(HASH_CHUNK_SIZE), b''):
+                            out.write(chunk)
+                # read(n) returns b'' when the connection drops early instead of raising
+                received = os.path.getsize(part_path)
+                if expected_size is not None and received < expected_size:
+                    raise http.client.IncompleteRead(b'', expected_size - received)
+            break
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            print(f"⚠️ Sync: download of {url} failed (attempt {attempt}/{SYNC_RETRIES}): {e}")
+            if attempt == SYNC_RETRIES:
+                raise
+
+    sha256 = file_sha256(part_path)
+    if expected_sha256 and sha256 != expected_sha256:
+        os.remove(part_path)
+        raise ValueError(f"Hash mismatch for {filename}")
+    local_name, _ = _place_file(part_path, folder, filename, sha256)
+    return local_name
+
+def sync_from_peer(peer_url):
+    """Pull missing or changed songs, covers and deletions from another jukebox"""
+    peer_url = peer_url.rstrip('/')
+    with _sync_lock:
+        manifest = _fetch_json(f"{peer_url}/api/sync/manifest")
+        if manifest.get('instance_id') == get_instance_id():
+            raise ValueError("Peer is this instance")
+
+        metadata = load_metadata()
+        tombstones = load_sync_state()['tombstones']
+        known_hashes = {
+            'music': {d['audio_sha256']: d['filename'] for d in metadata.values() if d.get('audio_sha256')},
+            'covers': {d['cover_sha256']: d['cover'] for d in metadata.values() if d.get('cover_sha256')}
+        }
+
+        # Diff: songs the peer has a winning version of, and the files we lack for them
+        wanted = {}
+        jobs = {}
+        renamed = {'music': {}, 'covers': {}}
+        failed = set()
+        pending = set(manifest.get('pending', []))
+        for song_id, remote in manifest.get('songs', {}).items():
+            # Not hashed on the peer yet - can't be verified, comes with a later sync
+            if song_id in pending:
+                continue
+            local = metadata.get(song_id) or tombstones.get(song_id)
+            if local and not remote_wins(local, remote):
+                continue
+            wanted[song_id] = remote
+            for folder_name, name_key, prefix in [('music', 'filename', 'audio'), ('covers', 'cover', 'cover')]:
+                name = remote.get(name_key)
+                sha256 = remote.get(f'{prefix}_sha256')
+                if not name:
+                    continue
+                if secure_filename(name) != name:
+                    failed.add((folder_name, name))
+                    continue
+                if sha256 in known_hashes[folder_name]:
+                    renamed[folder_name][name] = known_hashes[folder_name][sha256]
+                    continue
+                if folder_name == 'music':
+                    url = f"{peer_url}/api/stream/{quote(song_id)}"
+                else:
+                    url = f"{peer_url}/covers/{quote(name)}"
+                jobs.setdefault((folder_name, name), (url, sha256, remote.get(f'{prefix}_size')))
+
+        # Fetch several files at once
+        with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as pool:
+            futures = {key: pool.submit(_download_file, url, ARCHIVE_FOLDERS[key[0]], key[1], sha256, size)
+                       for key, (url, sha256, size) in jobs.items()}
+            for (folder_name, name), future in futures.items():
+                try:
+                    renamed[folder_name][name] = future.result()
+                except Exception as e:
+                    print(f"❌ Sync: {folder_name}/{name}: {e}")
+                    failed.add((folder_name, name))
+
+        # Songs with missing files wait for the next sync
+        wanted = {sid: d for sid, d in wanted.items()
+                  if ('music', d.get('filename')) not in failed and ('covers', d.get('cover')) not in failed}
+
+        # Merge against fresh metadata and commit once
+        with metadata_lock:
             metadata = load_metadata()
-            metadata[song_id] = {
-                'filename': filename,
-                'title': os.path.splitext(filename)[0],
-                'description': '',
-                'cover': None,
-                'uploaded_at': datetime.now().isoformat()
-            }
+            state = load_sync_state()
+            stats = merge_remote_songs(metadata, state['tombstones'], wanted,
+                                       manifest.get('tombstones', {}), renamed,
+                                       replaced_covers=state['replaced_covers'])
             save_metadata(metadata)
-            print(f"✅ Metadata saved")
-            print(f"{'='*60}\n")
-            
-            return jsonify({"status": "success", "file": filename, "id": song_id})
-        return jsonify({"error": "Ungültiger Dateityp. Nur MP3 erlaubt."}), 400
-    
-    return '''
+            save_sync_state(state)
+
+    stats.update({
+        'peer': peer_url,
+        'files_downloaded': len(jobs) - len(failed & set(jobs)),
+        'files_failed': len(failed),
+        'catalog_version': get_catalog_version(metadata)
+    })
+    return stats
+
+def sync_loop():
+    """Background thread: pull from all JUKEBOX_SYNC_PEERS periodically"""
+    while True:
+        for peer in SYNC_PEERS:
+            try:
+                print(f"🔄 Sync from {peer}: {sync_from_peer(peer)}")
+            except Exception as e:
+                print(f"❌ Sync from {peer} failed: {e}")
+        time.sleep(SYNC_INTERVAL)
+
+# --- PREFETCH MANIFEST FUNCTIONS (KIOSK OFFLINE CACHE) ---
+
+PREFETCH_ORDERS = ['most-played', 'recent', 'title']
+# Prefetch clients send this header when warming their cache, so those
+# fetches don't count as plays
+PREFETCH_HEADER = 'X-Jukebox-Prefetch'
+
+play_counts_lock = threading.Lock()
+
+# Build asset hashes, keyed by path and invalidated by (mtime, size)
+_build_hash_cache = {}
+
+def load_play_counts():
+    """Load play counts (kept out of the metadata so plays don't bump the catalog version)"""
+    if os.path.exists(PLAY_COUNTS_FILE):
+        try:
+            with open(PLAY_COUNTS_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            return {}
+    return {}
+
+def record_play(song_id):
+    """Count one play of a song"""
+    with play_counts_lock:
+        counts = load_play_counts()
+        counts[song_id] = counts.get(song_id, 0) + 1
+        write_json_atomic(PLAY_COUNTS_FILE, counts)
+
+def get_build_assets():
+    """All files of the Unity build with URL, size and hash"""
+    assets = []
+    build_root = os.path.join(SCRIPT_DIR, UNITY_FOLDER)
+    for dirpath, dirnames, filenames in os.walk(build_root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            st = os.stat(path)
+            cached = _build_hash_cache.get(path)
+            if not cached or cached[:2] != (st.st_mtime, st.st_size):
+                cached = (st.st_mtime, st.st_size, file_sha256(path))
+                _build_hash_cache[path] = cached
+            rel = os.path.relpath(path, build_root).replace(os.sep, '/')
+            assets.append({
+                'url': '/' if rel == 'index.html' else f'/{rel}',
+                'kind': 'build',
+                'size': st.st_size,
+                'sha256': cached[2]
+            })
+    return assets
+
+def get_build_fingerprint(assets):
+    """Short hash identifying one Unity build"""
+    h = hashlib.sha256()
+    for asset in assets:
+        h.update(f"{asset['url']}:{asset['sha256']}\n".encode('utf-8'))
+    return h.hexdigest()[:12]
+
+def parse_prefetch_version(version):
+    """Split a manifest version '<catalog version>-<build fingerprint>'"""
+    catalog, _, build = (version or '').partition('-')
+    return int(catalog or 0), build
+
+def build_prefetch_manifest(since=None, order='most-played', budget=None):
+    """Versioned list of everything the kiosk needs to keep playing offline.
+
+    Entries come in priority order: build assets, covers, then audio in
+    the requested `order`. With `since` (a previous manifest version) only
+    changed entries and removed URLs are returned. With `budget` (bytes)
+    covers and audio that don't fit are left out - and `since` is ignored,
+    because which songs fit depends on every song's size and play count,
+    not just on what changed.
+    """
+    if budget is not None:
+        since = None
+    metadata, _ = get_catalog()
+    pending = get_pending_songs(metadata)
+    if pending:
+        request_hashing()
+    state = load_sync_state()
+    tombstones = state['tombstones']
+    catalog_version = get_catalog_version(metadata, tombstones)
+
+    assets = get_build_assets()
+    build = get_build_fingerprint(assets)
+    since_catalog, since_build = parse_prefetch_version(since)
+
+    # Song order for priority hints
+    play_counts = load_play_counts()
+    songs = list(metadata.items())
+    if order == 'most-played':
+        songs.sort(key=lambda item: -play_counts.get(item[0], 0))
+    elif order == 'recent':
+        songs.sort(key=lambda item: item[1].get('uploaded_at', ''), reverse=True)
+    else:
+        songs.sort(key=lambda item: item[1].get('title', '').lower())
+    changed = [(sid, data) for sid, data in songs if since is None or data.get('version', 0) > since_catalog]
+
+    # The build only changes as a whole (git pull), so it's all or nothing
+    entries = [] if since is not None and since_build == build else assets
+    for song_id, data in changed:
+        if data.get('cover') and data.get('cover_sha256'):
+            entries.append({'url': f"/covers/{quote(data['cover'])}", 'kind': 'cover', 'song_id': song_id,
+                            'size': data.get('cover_size'), 'sha256': data['cover_sha256']})
+    for song_id, data in changed:
+        if data.get('audio_sha256'):
+            entries.append({'url': f"/api/stream/{quote(song_id)}", 'kind': 'audio', 'song_id': song_id,
+                            'size': data.get('audio_size'), 'sha256': data['audio_sha256'],
+                            'plays': play_counts.get(song_id, 0)})
+
+    # Byte budget for covers and audio, in priority order (the build is always needed
+    # and doesn't count against it)
+    selected = []
+    omitted = 0
+    build_size = 0
+    used = 0
+    for entry in entries:
+        size = entry.get('size') or 0
+        if entry['kind'] == 'build':
+            build_size += size
+        elif budget is not None and used + size > budget:
+            omitted += 1
+            continue
+        else:
+            used += size
+        entry['priority'] = len(selected)
+        selected.append(entry)
+
+    removed = []
+    if since is not None:
+        for song_id, tombstone in tombstones.items():
+            if tombstone.get('version', 0) > since_catalog:
+                removed.append(f"/api/stream/{quote(song_id)}")
+                if tombstone.get('cover'):
+                    removed.append(f"/covers/{quote(tombstone['cover'])}")
+        # Covers re-uploaded under a new name (unless the name is in use again)
+        in_use = {data.get('cover') for data in metadata.values()}
+        for cover, version in state['replaced_covers'].items():
+            if version > since_catalog and cover not in in_use:
+                removed.append(f"/covers/{quote(cover)}")
+
+    return {
+        'version': f"{catalog_version}-{build}",
+        'since': since,
+        'incremental': since is not None,
+        'songs_url': '/api/songs',
+        'fetch_headers': {PREFETCH_HEADER: '1'},
+        'order': order,
+        'budget': budget,
+        'build_size': build_size,
+        'media_size': used,
+        'total_size': build_size + used,
+        'omitted': omitted,
+        'entries': selected,
+        'removed': removed,
+        'pending': pending
+    }
+
+# --- BACKGROUND WARM-UP ---
+
+def warm_up():
+    """Fill caches after startup so the first requests don't pay for them.
+
+    Loads the catalog cache, git info and build asset hashes, and wakes the
+    hash worker for unhashed songs. Returns (seconds, number of songs).
+    """
+    start = time.perf_counter()
+    songs = 0
+    try:
+        songs = len(get_all_songs())
+        get_git_info()
+        get_build_assets()
+        request_hashing()
+        print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s ({songs} songs)")
+    except Exception as e:
+        print(f"❌ Warm-up failed: {e}")
+    mark_startup('warm-up')
+    return time.perf_counter() - start, songs
+
+# --- PAGE TEMPLATES ---
+# Compiled once at startup into static chunks and {{placeholder}} names, so a
+# request only joins strings instead of re-formatting the whole page.
+
+def compile_page(html, **static_values):
+    """Split a page at its {{name}} placeholders; fill static values right away"""
+    parts = re.split(r'\{\{(\w+)\}\}', html)
+    compiled = [parts[0]]
+    for i in range(1, len(parts), 2):
+        if parts[i] in static_values:
+            compiled[-1] += str(static_values[parts[i]]) + parts[i + 1]
+        else:
+            compiled += [parts[i], parts[i + 1]]
+    return compiled
+
+def render_page(compiled, **values):
+    """Fill a compiled page: even entries are static HTML, odd ones placeholder names"""
+    return ''.join(part if i % 2 == 0 else str(values[part]) for i, part in enumerate(compiled))
+
+UPLOAD_PAGE = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -301,84 +1122,41 @@ def upload_file():
     </html>
     '''
 
-# 7. Management Page (View and Edit Songs)
-@app.route('/manage')
-def manage_songs():
-    songs = get_all_songs()
-    
-    songs_html = ""
-    for song in songs:
-        cover_preview = ""
-        if song.get('cover'):
-            cover_preview = f'<img src="/covers/{song["cover"]}" style="max-width: 100px; max-height: 100px; border-radius: 6px; border: 1px solid #eee;">'
-        else:
-            cover_preview = '<div style="width: 100px; height: 100px; background: #f5f5f5; border-radius: 6px; display: flex; align-items: center; justify-content: center; color: #ccc; font-size: 12px; border: 1px solid #eee;">No image</div>'
-        
-        song_id = song['id']
-        songs_html += f'''
-        <div class="song-item" data-id="{song_id}">
-            <div class="song-cover">
-                <div id="cover-preview-{song_id}">{cover_preview}</div>
-                <input type="file" id="cover-{song_id}" accept="image/*" style="display:none" onchange="uploadCover('{song_id}', this)">
-                <button onclick="document.getElementById('cover-{song_id}').click()" class="btn btn-small">Change image</button>
-            </div>
-            <div class="song-info">
-                <div class="form-group">
-                    <label>Title</label>
-                    <input type="text" id="title-{song_id}" value="{song.get('title', '')}" class="form-input">
-                </div>
-                <div class="form-group">
-                    <label>Description</label>
-                    <textarea id="desc-{song_id}" class="form-input" rows="2">{song.get('description', '')}</textarea>
-                </div>
-                <div class="form-group">
-                    <label>Filename</label>
-                    <span class="filename">{song.get('filename', '')}</span>
-                </div>
-                <button onclick="saveSong('{song_id}')" class="btn btn-save">Save</button>
-                <button onclick="deleteSong('{song_id}')" class="btn btn-delete">Delete</button>
-            </div>
-        </div>
-        '''
-    
-    if not songs_html:
-        songs_html = '<div style="background: white; padding: 40px; border-radius: 8px; text-align: center; color: #999;">No songs yet. <a href="/upload" style="color: #333;">Upload some!</a></div>'
-    
-    return f'''
+MANAGE_PAGE = compile_page('''
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="UTF-8">
         <title>Manage Songs</title>
         <style>
-            * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-                   background: #f5f5f5; padding: 20px; }}
-            .header {{ background: white; padding: 20px 30px; border-radius: 8px; 
+            * { margin: 0; padding: 0; box-sizing: border-box; }
+            body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+                   background: #f5f5f5; padding: 20px; }
+            .header { background: white; padding: 20px 30px; border-radius: 8px; 
                       margin-bottom: 20px; display: flex; justify-content: space-between; 
-                      align-items: center; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-            .header h1 {{ font-size: 24px; color: #333; font-weight: 600; }}
-            .container {{ max-width: 1000px; margin: 0 auto; }}
-            .song-item {{ background: white; padding: 25px; border-radius: 8px; 
+                      align-items: center; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }
+            .header h1 { font-size: 24px; color: #333; font-weight: 600; }
+            .container { max-width: 1000px; margin: 0 auto; }
+            .song-item { background: white; padding: 25px; border-radius: 8px; 
                          margin-bottom: 15px; display: grid; grid-template-columns: 120px 1fr; 
-                         gap: 25px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-            .song-cover {{ text-align: center; }}
-            .form-group {{ margin-bottom: 15px; }}
-            .form-group label {{ display: block; color: #666; font-size: 13px; 
-                                margin-bottom: 6px; font-weight: 500; }}
-            .form-input {{ width: 100%; padding: 10px; border: 1px solid #ddd; 
-                          border-radius: 6px; font-size: 14px; }}
-            .form-input:focus {{ outline: none; border-color: #333; }}
-            .filename {{ color: #999; font-size: 13px; }}
-            .btn {{ padding: 10px 20px; border: 1px solid #ddd; border-radius: 6px;
+                         gap: 25px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }
+            .song-cover { text-align: center; }
+            .form-group { margin-bottom: 15px; }
+            .form-group label { display: block; color: #666; font-size: 13px; 
+                                margin-bottom: 6px; font-weight: 500; }
+            .form-input { width: 100%; padding: 10px; border: 1px solid #ddd; 
+                          border-radius: 6px; font-size: 14px; }
+            .form-input:focus { outline: none; border-color: #333; }
+            .filename { color: #999; font-size: 13px; }
+            .btn { padding: 10px 20px; border: 1px solid #ddd; border-radius: 6px;
                    cursor: pointer; font-size: 14px; text-decoration: none; background: white;
-                   color: #333; display: inline-block; transition: all 0.2s; }}
-            .btn:hover {{ background: #f5f5f5; border-color: #333; }}
-            .btn-small {{ padding: 8px 14px; font-size: 13px; margin-top: 8px; }}
-            .btn-save {{ background: #333; color: white; border-color: #333; margin-right: 8px; }}
-            .btn-save:hover {{ background: #000; }}
-            .btn-delete {{ background: white; color: #d32f2f; border-color: #d32f2f; }}
-            .btn-delete:hover {{ background: #d32f2f; color: white; }}
+                   color: #333; display: inline-block; transition: all 0.2s; }
+            .btn:hover { background: #f5f5f5; border-color: #333; }
+            .btn-small { padding: 8px 14px; font-size: 13px; margin-top: 8px; }
+            .btn-save { background: #333; color: white; border-color: #333; margin-right: 8px; }
+            .btn-save:hover { background: #000; }
+            .btn-delete { background: white; color: #d32f2f; border-color: #d32f2f; }
+            .btn-delete:hover { background: #d32f2f; color: white; }
         </style>
     </head>
     <body>
@@ -392,109 +1170,136 @@ def manage_songs():
                 </div>
             </div>
             
-            {songs_html}
+            {{songs_html}}
         </div>
         
         <script>
-            function saveSong(songId) {{
+            function saveSong(songId) {
                 const title = document.getElementById('title-' + songId).value;
                 const description = document.getElementById('desc-' + songId).value;
                 
-                fetch('/api/update-song', {{
+                fetch('/api/update-song', {
                     method: 'POST',
-                    headers: {{ 'Content-Type': 'application/json' }},
-                    body: JSON.stringify({{ id: songId, title: title, description: description }})
-                }})
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ id: songId, title: title, description: description })
+                })
                 .then(res => res.json())
                 .then(data => alert('✓ Saved'))
                 .catch(err => alert('✗ Error'));
-            }}
+            }
             
-            function uploadCover(songId, input) {{
+            function uploadCover(songId, input) {
                 if (!input.files || !input.files[0]) return;
                 
                 const formData = new FormData();
                 formData.append('file', input.files[0]);
                 formData.append('song_id', songId);
                 
-                fetch('/api/upload-cover', {{
+                fetch('/api/upload-cover', {
                     method: 'POST',
                     body: formData
-                }})
+                })
                 .then(res => res.json())
-                .then(data => {{
-                    if (data.cover) {{
+                .then(data => {
+                    if (data.cover) {
                         const preview = document.getElementById('cover-preview-' + songId);
                         preview.innerHTML = '<img src="/covers/' + data.cover + '?t=' + Date.now() + '" style="max-width: 100px; max-height: 100px; border-radius: 6px;">';
                         alert('✓ Cover uploaded');
-                    }}
-                }})
+                    }
+                })
                 .catch(err => alert('✗ Upload failed'));
-            }}
+            }
             
-            function deleteSong(songId) {{
+            function deleteSong(songId) {
                 if (!confirm('Delete this song?')) return;
                 
-                fetch('/api/delete-song', {{
+                fetch('/api/delete-song', {
                     method: 'POST',
-                    headers: {{ 'Content-Type': 'application/json' }},
-                    body: JSON.stringify({{ id: songId }})
-                }})
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ id: songId })
+                })
                 .then(res => res.json())
-                .then(data => {{ alert('✓ Deleted'); location.reload(); }})
+                .then(data => { alert('✓ Deleted'); location.reload(); })
                 .catch(err => alert('✗ Error'));
-            }}
+            }
         </script>
     </body>
     </html>
-    '''
+    ''')
 
-# 8. Settings Page
-@app.route('/settings')
-def settings_page():
-    git_info = get_git_info()
-    
-    return f'''
+MANAGE_SONG_ITEM = compile_page('''
+        <div class="song-item" data-id="{{song_id}}">
+            <div class="song-cover">
+                <div id="cover-preview-{{song_id}}">{{cover_preview}}</div>
+                <input type="file" id="cover-{{song_id}}" accept="image/*" style="display:none" onchange="uploadCover('{{song_id}}', this)">
+                <button onclick="document.getElementById('cover-{{song_id}}').click()" class="btn btn-small">Change image</button>
+            </div>
+            <div class="song-info">
+                <div class="form-group">
+                    <label>Title</label>
+                    <input type="text" id="title-{{song_id}}" value="{{title}}" class="form-input">
+                </div>
+                <div class="form-group">
+                    <label>Description</label>
+                    <textarea id="desc-{{song_id}}" class="form-input" rows="2">{{description}}</textarea>
+                </div>
+                <div class="form-group">
+                    <label>Filename</label>
+                    <span class="filename">{{filename}}</span>
+                </div>
+                <button onclick="saveSong('{{song_id}}')" class="btn btn-save">Save</button>
+                <button onclick="deleteSong('{{song_id}}')" class="btn btn-delete">Delete</button>
+            </div>
+        </div>
+        ''')
+
+MANAGE_COVER_IMAGE = compile_page('<img src="/covers/{{cover}}" style="max-width: 100px; max-height: 100px; border-radius: 6px; border: 1px solid #eee;">')
+
+MANAGE_NO_COVER = '<div style="width: 100px; height: 100px; background: #f5f5f5; border-radius: 6px; display: flex; align-items: center; justify-content: center; color: #ccc; font-size: 12px; border: 1px solid #eee;">No image</div>'
+
+MANAGE_NO_SONGS = '<div style="background: white; padding: 40px; border-radius: 8px; text-align: center; color: #999;">No songs yet. <a href="/upload" style="color: #333;">Upload some!</a></div>'
+
+SETTINGS_PAGE = compile_page('''
     <!DOCTYPE html>
     <html>
     <head>
         <meta charset="UTF-8">
         <title>Settings</title>
         <style>
-            * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-            body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-                   background: #f5f5f5; padding: 20px; }}
-            .container {{ max-width: 800px; margin: 0 auto; }}
-            .header {{ background: white; padding: 20px 30px; border-radius: 8px; 
+            * { margin: 0; padding: 0; box-sizing: border-box; }
+            body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+                   background: #f5f5f5; padding: 20px; }
+            .container { max-width: 800px; margin: 0 auto; }
+            .header { background: white; padding: 20px 30px; border-radius: 8px; 
                       margin-bottom: 20px; display: flex; justify-content: space-between; 
-                      align-items: center; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-            .header h1 {{ font-size: 24px; color: #333; font-weight: 600; }}
-            .section {{ background: white; padding: 25px; border-radius: 8px; 
-                       margin-bottom: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-            .section h2 {{ color: #333; margin-bottom: 18px; font-size: 16px; font-weight: 600; }}
-            .info-row {{ display: flex; justify-content: space-between; padding: 10px 0;
-                        border-bottom: 1px solid #f5f5f5; }}
-            .info-row:last-child {{ border-bottom: none; }}
-            .info-label {{ color: #666; font-size: 14px; }}
-            .info-value {{ color: #333; font-family: 'SF Mono', Monaco, monospace; font-size: 13px; }}
-            .btn {{ padding: 10px 20px; border: 1px solid #ddd; border-radius: 6px;
+                      align-items: center; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }
+            .header h1 { font-size: 24px; color: #333; font-weight: 600; }
+            .section { background: white; padding: 25px; border-radius: 8px; 
+                       margin-bottom: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }
+            .section h2 { color: #333; margin-bottom: 18px; font-size: 16px; font-weight: 600; }
+            .info-row { display: flex; justify-content: space-between; padding: 10px 0;
+                        border-bottom: 1px solid #f5f5f5; }
+            .info-row:last-child { border-bottom: none; }
+            .info-label { color: #666; font-size: 14px; }
+            .info-value { color: #333; font-family: 'SF Mono', Monaco, monospace; font-size: 13px; }
+            .btn { padding: 10px 20px; border: 1px solid #ddd; border-radius: 6px;
                    cursor: pointer; font-size: 14px; text-decoration: none; background: white;
-                   color: #333; display: inline-block; transition: all 0.2s; }}
-            .btn:hover {{ background: #f5f5f5; border-color: #333; }}
-            .btn:disabled {{ opacity: 0.4; cursor: not-allowed; }}
-            .btn-update {{ background: #333; color: white; border-color: #333; }}
-            .btn-update:hover {{ background: #000; }}
-            .btn-danger {{ background: white; color: #d32f2f; border-color: #d32f2f; }}
-            .btn-danger:hover {{ background: #d32f2f; color: white; }}
-            #output {{ background: #f5f5f5; color: #333; padding: 15px; border-radius: 6px;
+                   color: #333; display: inline-block; transition: all 0.2s; }
+            .btn:hover { background: #f5f5f5; border-color: #333; }
+            .btn:disabled { opacity: 0.4; cursor: not-allowed; }
+            .btn-update { background: #333; color: white; border-color: #333; }
+            .btn-update:hover { background: #000; }
+            .btn-danger { background: white; color: #d32f2f; border-color: #d32f2f; }
+            .btn-danger:hover { background: #d32f2f; color: white; }
+            #output { background: #f5f5f5; color: #333; padding: 15px; border-radius: 6px;
                       font-family: 'SF Mono', Monaco, monospace; font-size: 12px; 
                       margin-top: 15px; max-height: 300px; overflow-y: auto; display: none;
-                      border: 1px solid #e0e0e0; }}
-            .status {{ display: inline-block; padding: 4px 10px; border-radius: 4px; 
-                      font-size: 12px; font-weight: 500; }}
-            .status-ok {{ background: #e8f5e9; color: #2e7d32; }}
-            .status-error {{ background: #ffebee; color: #c62828; }}
-            .note {{ color: #666; font-size: 13px; margin-top: 12px; line-height: 1.5; }}
+                      border: 1px solid #e0e0e0; }
+            .status { display: inline-block; padding: 4px 10px; border-radius: 4px; 
+                      font-size: 12px; font-weight: 500; }
+            .status-ok { background: #e8f5e9; color: #2e7d32; }
+            .status-error { background: #ffebee; color: #c62828; }
+            .note { color: #666; font-size: 13px; margin-top: 12px; line-height: 1.5; }
         </style>
     </head>
     <body>
@@ -511,15 +1316,15 @@ def settings_page():
                 <h2>Data Storage</h2>
                 <div class="info-row">
                     <span class="info-label">Music folder</span>
-                    <span class="info-value">{UPLOAD_FOLDER}</span>
+                    <span class="info-value">{{UPLOAD_FOLDER}}</span>
                 </div>
                 <div class="info-row">
                     <span class="info-label">Covers folder</span>
-                    <span class="info-value">{COVERS_FOLDER}</span>
+                    <span class="info-value">{{COVERS_FOLDER}}</span>
                 </div>
                 <div class="info-row">
                     <span class="info-label">Metadata file</span>
-                    <span class="info-value">{METADATA_FILE}</span>
+                    <span class="info-value">{{METADATA_FILE}}</span>
                 </div>
                 <p class="note">All data is stored outside the git repository and persists through updates.</p>
             </div>
@@ -528,24 +1333,24 @@ def settings_page():
                 <h2>Git Version Control</h2>
                 <div class="info-row">
                     <span class="info-label">Status</span>
-                    <span class="status {'status-ok' if git_info['available'] else 'status-error'}">
-                        {'Available' if git_info['available'] else 'Not available'}
+                    <span class="status {{status_class}}">
+                        {{status_text}}
                     </span>
                 </div>
                 <div class="info-row">
                     <span class="info-label">Branch</span>
-                    <span class="info-value">{git_info['branch']}</span>
+                    <span class="info-value">{{branch}}</span>
                 </div>
                 <div class="info-row">
                     <span class="info-label">Last commit</span>
-                    <span class="info-value">{git_info['commit']}</span>
+                    <span class="info-value">{{commit}}</span>
                 </div>
                 
                 <div style="margin-top: 18px;">
-                    <button onclick="gitPull()" class="btn btn-update" {'disabled' if not git_info['available'] else ''}>
+                    <button onclick="gitPull()" class="btn btn-update" {{disabled}}>
                         Update from Git
                     </button>
-                    <button onclick="gitStatus()" class="btn" {'disabled' if not git_info['available'] else ''}>
+                    <button onclick="gitStatus()" class="btn" {{disabled}}>
                         Git Status
                     </button>
                 </div>
@@ -555,46 +1360,217 @@ def settings_page():
         </div>
         
         <script>
-            function showOutput(text) {{
+            function showOutput(text) {
                 const output = document.getElementById('output');
                 output.style.display = 'block';
                 output.textContent = text;
-            }}
+            }
             
-            function gitPull() {{
+            function gitPull() {
                 if (!confirm('Update app from Git? Server will restart.')) return;
                 
                 showOutput('Updating...');
                 
-                fetch('/api/git-pull', {{ method: 'POST' }})
+                fetch('/api/git-pull', { method: 'POST' })
                 .then(res => res.json())
-                .then(data => {{
+                .then(data => {
                     showOutput(data.output);
-                    if (data.success) {{
+                    if (data.success) {
                         alert('✓ Update successful! Restarting...');
                         setTimeout(() => location.reload(), 3000);
-                    }} else {{
+                    } else {
                         alert('✗ Update failed. Check output.');
-                    }}
-                }})
-                .catch(err => {{
+                    }
+                })
+                .catch(err => {
                     showOutput('Error: ' + err);
                     alert('✗ Update error');
-                }});
-            }}
+                });
+            }
             
-            function gitStatus() {{
+            function gitStatus() {
                 showOutput('Loading...');
                 
                 fetch('/api/git-status')
                 .then(res => res.json())
                 .then(data => showOutput(data.output))
                 .catch(err => showOutput('Error: ' + err));
-            }}
+            }
         </script>
     </body>
     </html>
-    '''
+    ''', UPLOAD_FOLDER=UPLOAD_FOLDER, COVERS_FOLDER=COVERS_FOLDER, METADATA_FILE=METADATA_FILE)
+
+mark_startup('templates')
+
+# --- ROUTES ---
+
+# 1. Serve the Unity Game (Homepage)
+@app.route('/')
+def index():
+    if not os.path.exists(os.path.join(UNITY_FOLDER, 'index.html')):
+        return "<h1>Unity Build Not Found</h1><p>Ensure your WebGL files are in the 'webgl_build' folder.</p>"
+    return send_from_directory(UNITY_FOLDER, 'index.html')
+
+# 2. Support Unity static files (.js, .wasm, .data)
+@app.route('/<path:path>')
+def serve_static(path):
+    # Don't serve our management routes as static files
+    if path.startswith('api/') or path in ['upload', 'manage', 'settings']:
+        return "Not found", 404
+    return send_from_directory(UNITY_FOLDER, path)
+
+# 3. API: List all songs with metadata for Unity
+@app.route('/api/songs')
+def list_songs():
+    songs = get_all_songs()
+    return jsonify(songs)
+
+# 4. Stream Audio File by ID
+@app.route('/api/stream/<song_id>')
+def stream_song(song_id):
+    print(f"\n{'='*60}")
+    print(f"🎵 Stream request for ID: {song_id}")
+    print(f"{'='*60}")
+    
+    # Load metadata
+    metadata, _ = get_catalog()
+    print(f"📋 Available song IDs: {list(metadata.keys())}")
+    
+    # Get song data
+    song = get_song_by_id(song_id)
+    if not song:
+        print(f"❌ Song not found for ID: {song_id}")
+        return jsonify({"error": "Song not found"}), 404
+    
+    filename = song.get('filename')
+    if not filename:
+        print(f"❌ No filename in song data for ID: {song_id}")
+        return jsonify({"error": "Invalid song data"}), 404
+    
+    print(f"📂 Filename from metadata: {filename}")
+    print(f"📂 Upload folder: {app.config['UPLOAD_FOLDER']}")
+    
+    # Build absolute path
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    abs_file_path = os.path.abspath(file_path)
+    
+    print(f"📂 Relative path: {file_path}")
+    print(f"📂 Absolute path: {abs_file_path}")
+    print(f"📂 File exists: {os.path.exists(abs_file_path)}")
+    
+    # List all files in directory for debugging
+    if os.path.exists(app.config['UPLOAD_FOLDER']):
+        all_files = os.listdir(app.config['UPLOAD_FOLDER'])
+        print(f"📂 All files in upload folder: {all_files}")
+    else:
+        print(f"❌ Upload folder does not exist: {app.config['UPLOAD_FOLDER']}")
+    
+    if not os.path.exists(abs_file_path):
+        print(f"❌ File not found: {abs_file_path}")
+        return jsonify({"error": "Audio file not found on disk"}), 404
+    
+    # Count plays for prefetch priority (not sync downloads, cache prefetches
+    # or range continuations). A failed count must never fail the stream.
+    if 'X-Jukebox-Sync' not in request.headers and PREFETCH_HEADER not in request.headers and \
+            request.headers.get('Range', 'bytes=0-').startswith('bytes=0-'):
+        try:
+            record_play(song_id)
+        except Exception as e:
+            print(f"⚠️ Could not record play: {e}")
+    
+    print(f"✅ Streaming: {filename}")
+    print(f"{'='*60}\n")
+    
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+# 5. Serve Cover Images
+@app.route('/covers/<path:filename>')
+def get_cover(filename):
+    return send_from_directory(app.config['COVERS_FOLDER'], filename)
+
+# 6. Drag & Drop Upload Page
+@app.route('/upload', methods=['GET', 'POST'])
+def upload_file():
+    if request.method == 'POST':
+        if 'file' not in request.files:
+            return jsonify({"error": "Keine Datei gefunden"}), 400
+        file = request.files['file']
+        if file and file.filename.endswith('.mp3'):
+            filename = secure_filename(file.filename)
+            
+            # Generate unique ID for this song
+            song_id = generate_song_id()
+            
+            # Build absolute path
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            abs_file_path = os.path.abspath(file_path)
+            
+            print(f"\n{'='*60}")
+            print(f"📤 Upload Request")
+            print(f"{'='*60}")
+            print(f"Original filename: {file.filename}")
+            print(f"Secure filename: {filename}")
+            print(f"Song ID: {song_id}")
+            print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
+            print(f"File path: {abs_file_path}")
+            
+            # Save file
+            file.save(abs_file_path)
+            print(f"✅ File saved successfully")
+            print(f"File exists after save: {os.path.exists(abs_file_path)}")
+            
+            # Initialize metadata with ID
+            song = {
+                'filename': filename,
+                'title': os.path.splitext(filename)[0],
+                'description': '',
+                'cover': None,
+                'uploaded_at': datetime.now().isoformat()
+            }
+            set_file_info(song, 'audio', abs_file_path)
+            with metadata_lock:
+                metadata = load_metadata()
+                metadata[song_id] = song
+                touch_song(metadata, song_id)
+                save_metadata(metadata)
+            print(f"✅ Metadata saved")
+            print(f"{'='*60}\n")
+            
+            return jsonify({"status": "success", "file": filename, "id": song_id})
+        return jsonify({"error": "Ungültiger Dateityp. Nur MP3 erlaubt."}), 400
+    
+    return UPLOAD_PAGE
+
+# 7. Management Page (View and Edit Songs)
+@app.route('/manage')
+def manage_songs():
+    songs = get_all_songs()
+    
+    songs_html = []
+    for song in songs:
+        if song.get('cover'):
+            cover_preview = render_page(MANAGE_COVER_IMAGE, cover=song['cover'])
+        else:
+            cover_preview = MANAGE_NO_COVER
+        
+        songs_html.append(render_page(MANAGE_SONG_ITEM, song_id=song['id'], cover_preview=cover_preview,
+                                      title=song.get('title', ''), description=song.get('description', ''),
+                                      filename=song.get('filename', '')))
+    
+    return render_page(MANAGE_PAGE, songs_html=''.join(songs_html) or MANAGE_NO_SONGS)
+
+# 8. Settings Page
+@app.route('/settings')
+def settings_page():
+    git_info = get_git_info()
+    
+    return render_page(SETTINGS_PAGE,
+                       status_class='status-ok' if git_info['available'] else 'status-error',
+                       status_text='Available' if git_info['available'] else 'Not available',
+                       branch=git_info['branch'],
+                       commit=git_info['commit'],
+                       disabled='disabled' if not git_info['available'] else '')
 
 # 9. API: Update song metadata
 @app.route('/api/update-song', methods=['POST'])
@@ -607,13 +1583,15 @@ def update_song():
     if not song_id:
         return jsonify({"error": "Keine ID angegeben"}), 400
     
-    metadata = load_metadata()
-    if song_id not in metadata:
-        return jsonify({"error": "Song nicht gefunden"}), 404
-    
-    metadata[song_id]['title'] = title
-    metadata[song_id]['description'] = description
-    save_metadata(metadata)
+    with metadata_lock:
+        metadata = load_metadata()
+        if song_id not in metadata:
+            return jsonify({"error": "Song nicht gefunden"}), 404
+        
+        metadata[song_id]['title'] = title
+        metadata[song_id]['description'] = description
+        touch_song(metadata, song_id)
+        save_metadata(metadata)
     
     return jsonify({"status": "success", "id": song_id})
 
@@ -626,19 +1604,32 @@ def upload_cover():
     file = request.files['file']
     song_id = request.form['song_id']
     
-    metadata = load_metadata()
-    if song_id not in metadata:
+    if song_id not in load_metadata():
         return jsonify({"error": "Song nicht gefunden"}), 404
     
     if file and file.filename:
         # Create a unique filename using song ID
         ext = os.path.splitext(file.filename)[1]
         cover_filename = secure_filename(f"{song_id}_cover{ext}")
-        file.save(os.path.join(app.config['COVERS_FOLDER'], cover_filename))
+        cover_path = os.path.join(app.config['COVERS_FOLDER'], cover_filename)
+        file.save(cover_path)
         
         # Update metadata
-        metadata[song_id]['cover'] = cover_filename
-        save_metadata(metadata)
+        with metadata_lock:
+            metadata = load_metadata()
+            if song_id not in metadata:
+                return jsonify({"error": "Song nicht gefunden"}), 404
+            old_cover = metadata[song_id].get('cover')
+            metadata[song_id]['cover'] = cover_filename
+            set_file_info(metadata[song_id], 'cover', cover_path)
+            touch_song(metadata, song_id)
+            save_metadata(metadata)
+            if old_cover and old_cover != cover_filename:
+                # New extension: the old file is gone, tell prefetch clients
+                state = load_sync_state()
+                state['replaced_covers'][old_cover] = metadata[song_id]['version']
+                save_sync_state(state)
+                delete_unused_file(metadata, 'cover', old_cover)
         
         return jsonify({"status": "success", "cover": cover_filename})
     
@@ -653,28 +1644,21 @@ def delete_song():
     if not song_id:
         return jsonify({"error": "Keine ID angegeben"}), 400
     
-    metadata = load_metadata()
-    if song_id not in metadata:
-        return jsonify({"error": "Song nicht gefunden"}), 404
-    
-    song_data = metadata[song_id]
-    
-    # Delete MP3 file
-    filename = song_data.get('filename')
-    if filename:
-        mp3_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(mp3_path):
-            os.remove(mp3_path)
-    
-    # Delete cover if exists
-    if song_data.get('cover'):
-        cover_path = os.path.join(app.config['COVERS_FOLDER'], song_data['cover'])
-        if os.path.exists(cover_path):
-            os.remove(cover_path)
-    
-    # Remove from metadata
-    del metadata[song_id]
-    save_metadata(metadata)
+    with metadata_lock:
+        metadata = load_metadata()
+        if song_id not in metadata:
+            return jsonify({"error": "Song nicht gefunden"}), 404
+        
+        # Delete MP3 and cover (unless shared with another song)
+        delete_song_files(metadata, song_id)
+        
+        # Remember the deletion for sync peers, then remove from metadata
+        state = load_sync_state()
+        version = get_catalog_version(metadata, state['tombstones']) + 1
+        state['tombstones'][song_id] = make_tombstone(metadata[song_id], version)
+        save_sync_state(state)
+        del metadata[song_id]
+        save_metadata(metadata)
     
     return jsonify({"status": "success", "deleted": song_id})
 
@@ -697,7 +1681,14 @@ def api_git_status():
 # 14. API: Reset metadata
 @app.route('/api/reset-metadata', methods=['POST'])
 def reset_metadata():
-    save_metadata({})
+    with metadata_lock:
+        state = load_sync_state()
+        metadata = load_metadata()
+        version = get_catalog_version(metadata, state['tombstones']) + 1
+        for song_id, song in metadata.items():
+            state['tombstones'][song_id] = make_tombstone(song, version)
+        save_sync_state(state)
+        save_metadata({})
     return jsonify({"status": "success"})
 
 # 15. API: Debug - List files (only in debug mode)
@@ -721,16 +1712,122 @@ def debug_files():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# 16. API: Export library as a streamed tar archive
+@app.route('/api/export')
+def export_library():
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "Ungültige Version"}), 400
+
+    # Songs without a hash are exported as they are; import hashes while unpacking
+    metadata, _ = get_catalog()
+    tombstones = load_sync_state()['tombstones']
+    version = get_catalog_version(metadata, tombstones)
+    suffix = f"_since{since}" if since else ""
+    filename = f"jukebox_export_v{version}{suffix}.tar"
+    return Response(generate_export_archive(metadata, tombstones, since), mimetype='application/x-tar',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Catalog-Version': str(version)})
+
+# 17. API: Import a previously exported archive (raw tar request body)
+@app.route('/api/import', methods=['POST'])
+def import_library():
+    try:
+        result = import_archive(request.stream)
+    except (tarfile.TarError, ValueError) as e:
+        return jsonify({"error": f"Ungültiges Archiv: {e}"}), 400
+    return jsonify({"status": "success", **result})
+
+# 18. API: Sync manifest (songs, hashes, version vectors, deletions)
+@app.route('/api/sync/manifest')
+def sync_manifest():
+    return jsonify(build_sync_manifest())
+
+# 19. API: Pull changes from a peer jukebox
+@app.route('/api/sync/pull', methods=['POST'])
+def sync_pull():
+    data = request.json or {}
+    peer = data.get('peer')
+    if not peer:
+        return jsonify({"error": "Kein Peer angegeben"}), 400
+    try:
+        result = sync_from_peer(peer)
+    except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError) as e:
+        return jsonify({"error": f"Sync fehlgeschlagen: {e}"}), 502
+    return jsonify({"status": "success", **result})
+
+# 20. API: Prefetch manifest for offline kiosk clients
+@app.route('/api/prefetch-manifest')
+def prefetch_manifest():
+    order = request.args.get('order', 'most-played')
+    if order not in PREFETCH_ORDERS:
+        return jsonify({"error": f"Ungültige Reihenfolge, erlaubt: {', '.join(PREFETCH_ORDERS)}"}), 400
+    try:
+        budget = int(request.args['budget']) if request.args.get('budget') else None
+        since = request.args.get('since') or None
+        parse_prefetch_version(since)
+    except ValueError:
+        return jsonify({"error": "Ungültiges Budget oder Version"}), 400
+    return jsonify(build_prefetch_manifest(since, order, budget))
+
+# 21. API: Debug - Startup timings
+@app.route('/api/debug/startup')
+def debug_startup():
+    timings = dict(startup_timings)
+    return jsonify({
+        "phases": [{"phase": phase, "ms": round(elapsed * 1000, 1)} for phase, elapsed in startup_timings],
+        "ready_ms": round(timings['ready'] * 1000, 1) if 'ready' in timings else None,
+        "target_ms": round(STARTUP_TARGET * 1000, 1),
+        "measured_from": STARTUP_ORIGIN
+    })
+
+mark_startup('routes')
+
+def startup_check():
+    """Start the server on a free port and time the first byte of /api/songs, then the warm-up.
+
+    Returns the exit code: 0 if both are within JUKEBOX_STARTUP_TARGET.
+    """
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    mark_startup('listening')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/api/songs") as resp:
+        resp.read(1)
+        mark_startup('ready')
+        resp.read()
+    warm_up_time, songs = warm_up()
+    server.shutdown()
+    print_startup_report(warm_up_time, songs)
+    ready = dict(startup_timings)['ready']
+    return 0 if ready <= STARTUP_TARGET and warm_up_time <= STARTUP_TARGET else 1
+
 if __name__ == '__main__':
+    # --startup-check: serve one real request, warm all caches, print the timing
+    # report and exit non-zero if first byte or warm-up miss JUKEBOX_STARTUP_TARGET
+    if '--startup-check' in sys.argv:
+        sys.exit(startup_check())
+    
     print("\n" + "="*60)
     print("🚀 Jukebox Server aktiv!")
     print("="*60)
-    print(f"👉 Jukebox:    http://localhost:5001")
-    print(f"👉 Upload:     http://localhost:5001/upload")
-    print(f"👉 Verwalten:  http://localhost:5001/manage")
-    print(f"👉 Settings:   http://localhost:5001/settings")
+    print(f"👉 Jukebox:    http://localhost:{PORT}")
+    print(f"👉 Upload:     http://localhost:{PORT}/upload")
+    print(f"👉 Verwalten:  http://localhost:{PORT}/manage")
+    print(f"👉 Settings:   http://localhost:{PORT}/settings")
     print("="*60)
     print(f"📂 Daten:      {DATA_FOLDER}")
+    if SYNC_PEERS:
+        print(f"🔄 Sync-Peers: {', '.join(SYNC_PEERS)}")
     print("="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    # Bind first, so 'ready' means the listener accepts connections
+    server = make_server('0.0.0.0', PORT, app, threaded=True)
+    mark_startup('ready')
+    print_startup_report()
+    
+    threading.Thread(target=warm_up, daemon=True).start()
+    if SYNC_PEERS:
+        threading.Thread(target=sync_loop, daemon=True).start()
+    
+    server.serve_forever()
\ No newline at end of file